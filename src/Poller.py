@@ -1,9 +1,9 @@
-from pipeline.api import StockDataAPI
+from pipeline.api import StockDataAPIAsync
 from pipeline.data_poller import DataPoller
 
-api = StockDataAPI()
+api = StockDataAPIAsync()
 
 poller = DataPoller(
     macrotrends_api=api
 )
-poller.run()
\ No newline at end of file
+poller.run()
@@ -1,5 +1,6 @@
 import streamlit as st
 import pandas as pd
+import polars as pl
 from datetime import datetime, timedelta
 from st_aggrid import AgGrid, GridOptionsBuilder
 from pipeline.db import PostgreSQL
@@ -9,30 +10,120 @@ from math import ceil
 
 from utils.misc import check_password
 
-def calculate_avg_pb_ratios(stock_data: pd.DataFrame) -> tuple[float, float, int]:
+def calculate_avg_pb_ratios(dates: np.ndarray, pb: np.ndarray) -> tuple[float, float, int]:
     """
-    :param stock_data: DataFrame containing the individual stock data
-    
+    Single numpy pass over the raw arrays — no pandas sort/filter per call.
+
+    :param dates: datetime64 array of report dates for a single stock
+    :param pb: array of the matching P/B ratios
+
     :return: A tuple containing the 3-year average P/B ratio and the max (7-10) year average P/B ratio, and the available years
     """
-    stock_data.sort_values('date', inplace=True)
-    
-    # Calculate the date three years back from the most recent date
-    last_q_report_date = stock_data['date'].max()
-    available_years = (last_q_report_date.year - stock_data['date'].min().year) + 1
-    
-    # Calculate the 3-year average p/b ratio
-    date_three_years_ago = last_q_report_date - timedelta(days=3*365)
-    avg_calc_rows = stock_data[stock_data['date'] > date_three_years_ago]
-    avg_pb_3_year = avg_calc_rows['price_to_book_ratio'].mean()
-    
+    last_q_report_date = dates.max()
+    available_years = (last_q_report_date.astype('datetime64[Y]').astype(int) - dates.min().astype('datetime64[Y]').astype(int)) + 1
+
+    # Calculate the 3-year average p/b ratio; nanmean because P/E-only report
+    # dates carry NaN P/B from the outer merge, as do scrubbed ±inf values
+    date_three_years_ago = last_q_report_date - np.timedelta64(3*365, 'D')
+    avg_pb_3_year = np.nanmean(pb[dates > date_three_years_ago])
+
     # Calculate the average P/B ratio for the entire available period (this would already be filtered to 7-10 years)
-    avg_pb_max_year = stock_data['price_to_book_ratio'].mean()
-    
+    avg_pb_max_year = np.nanmean(pb)
+
     return avg_pb_3_year, avg_pb_max_year, available_years
 
 
-@st.cache_data
+# Cheap frame hash: shape + symbol count catch reloads, and the newest
+# timestamp makes the key roll over when the poller refreshes the data even
+# though the shape is unchanged
+def _frame_key(df: pd.DataFrame) -> tuple:
+    newest = df['date'].max() if 'date' in df.columns else df['last_update'].max()
+    return (df.shape, df['symbol'].nunique(), str(newest))
+
+
+@st.cache_data(ttl=1800, show_spinner=False, hash_funcs={pd.DataFrame: _frame_key})
+def compute_symbol_aggregates(df, current_df) -> pd.DataFrame:
+    """
+    Compute the per-symbol screening aggregates — the expensive reduction over
+    the full ratio history. The cache key depends only on the loaded data, not
+    on the sidebar criteria, so nudging a slider never triggers a rescan.
+
+    The aggregates run through a Polars lazy pipeline, which fuses the
+    filter/aggregate/join passes and executes them multithreaded over Arrow
+    columns.
+
+    :return: A DataFrame indexed by symbol with columns n_years, all_pos_pb,
+             avg_pb_3y, avg_pb_max, n_pos_pe_years, latest_pb, latest_pe
+    """
+    # The frame arrives pre-sorted by (symbol, date) from load_data, so last()
+    # inside each group is already the latest report — no sort needed here
+    lf = pl.from_pandas(df[['symbol', 'date', 'year', 'price_to_book_ratio', 'pe_ratio']]).lazy()
+    current_lf = pl.from_pandas(current_df[['symbol', 'pb_ratio', 'pe_ratio']]).lazy()
+
+    # Per-symbol history aggregates in one fused pass
+    agg = (
+        lf.group_by('symbol')
+        .agg([
+            pl.col('year').n_unique().alias('n_years'),
+            (pl.col('price_to_book_ratio') > 0).all().alias('all_pos_pb'),
+            pl.col('price_to_book_ratio').mean().alias('avg_pb_max'),
+            # 3-year average P/B, measured back from the symbol's most recent report
+            pl.col('price_to_book_ratio')
+              .filter(pl.col('date') > pl.col('date').max() - pl.duration(days=3*365))
+              .mean()
+              .alias('avg_pb_3y'),
+            # Last non-null reading: the literal last row can be null (P/E-only
+            # dates from the outer merge carry no P/B and vice versa), which
+            # would null latest_pb/latest_pe for symbols missing from
+            # current_ratios and silently drop them from every screen
+            pl.col('price_to_book_ratio').drop_nulls().last().alias('hist_pb'),
+            pl.col('pe_ratio').drop_nulls().last().alias('hist_pe'),
+        ])
+    )
+
+    # Count the years with a positive P/E, taken from the latest report of each
+    # year: one global sort, then drop to a single row per (symbol, year) — no
+    # nested per-group sort inside the aggregation
+    pos_pe = (
+        lf.sort('date', descending=True)
+        .unique(subset=['symbol', 'year'], keep='first')
+        .group_by('symbol')
+        .agg((pl.col('pe_ratio') > 0).sum().alias('n_pos_pe_years'))
+    )
+
+    # Overlay the live current ratios where available
+    agg = (
+        agg.join(pos_pe, on='symbol', how='left')
+        .join(current_lf, on='symbol', how='left')
+        .with_columns([
+            pl.coalesce(['pb_ratio', 'hist_pb']).alias('latest_pb'),
+            pl.coalesce(['pe_ratio', 'hist_pe']).alias('latest_pe'),
+        ])
+        .select(['symbol', 'n_years', 'all_pos_pb', 'avg_pb_3y', 'avg_pb_max',
+                 'n_pos_pe_years', 'latest_pb', 'latest_pe'])
+    )
+
+    return agg.collect().to_pandas().set_index('symbol')
+
+
+def apply_criteria(agg: pd.DataFrame, criteria: dict) -> pd.Index:
+    """
+    Apply the scalar screening thresholds to the aggregate frame. This is pure
+    boolean algebra over a few hundred rows, so it runs uncached on every rerun.
+    """
+    valid = (
+        (agg['n_years'] >= criteria['years_pb_history'])
+        & (agg['latest_pb'] < criteria['max_current_pb_ratio'])
+        & (agg['latest_pb'] <= criteria['pb_margin_of_safety'] * agg[['avg_pb_3y', 'avg_pb_max']].min(axis=1))
+        & (agg['n_pos_pe_years'] >= criteria['years_positive_pe_history'])
+        & (agg['latest_pe'] < criteria['max_current_pe_ratio'])
+    )
+    if criteria['only_positive_pb']:
+        valid &= agg['all_pos_pb']
+
+    return agg.index[valid]
+
+
 def screen_stocks(df, current_df, criteria) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Screen stocks based on the following criteria:
@@ -40,80 +131,35 @@ def screen_stocks(df, current_df, criteria) -> tuple[pd.DataFrame, pd.DataFrame]
     * Current P/B ratio is less than the specified value and not equal to 0
     * Current price-to-book (P/B) ratio is less than the lower of either the 3-year average P/B ratio
       or the 7+ year average P/B ratio, multiplied by the margin of safety factor.
-    """    
-    # Convert the date column to datetime
-    df['date'] = pd.to_datetime(df['date'])
-    df['year'] = df['date'].dt.year
-    
+
+    Expects the date/year columns prepared by load_data; the input frames are
+    never mutated here.
+    """
     # Remove rows from the current year
     df = df[df['year'] != datetime.now().year]
-    
+
     # Determine the most recent year in the filtered dataset
     most_recent_year = df['year'].max()
-    
+
     # Remove any data that is older than 10 years from the most recent year
     df = df[df['year'] > (most_recent_year - 10)]
-    
-    def stock_meets_criteria(group) -> bool:
-        """
-        Has to be inside the body of this function to get the criteria variable.
-        """        
-        valid = True
-        
-        try:
-            current_ratios_row = current_df[current_df['symbol'] == group['symbol'].iloc[0]].iloc[0]
-            use_current_ratios = True
-        except Exception as e:
-            # print(f"WARNING: Error fetching current ratios for {group['symbol'].iloc[0]}:", e)
-            use_current_ratios = False
-        
-        # Check if the stock has at least x years of P/B history
-        if group['year'].nunique() < criteria['years_pb_history']:
-            valid = False
-        
-        # Ensure all P/B ratios in the period are positive
-        if criteria['only_positive_pb']:
-            pb_ratios = group['price_to_book_ratio']
-            if (pb_ratios <= 0).any():
-                valid = False
-            
-        # Get the latest P/B ratio and check if it meets the current P/B ratio criteria
-        latest_pb_ratio = current_ratios_row['pb_ratio'] if use_current_ratios else group.sort_values('date').iloc[-1]['price_to_book_ratio']
-        if latest_pb_ratio >= criteria['max_current_pb_ratio']:
-            valid = False
-        
-        # Check if the latest P/B ratio is less than the safety threshold
-        avg_pb_3_year, avg_pb_max_year, _ = calculate_avg_pb_ratios(group)        
-        if latest_pb_ratio > (criteria['pb_margin_of_safety'] * min(avg_pb_3_year, avg_pb_max_year)):
-            valid = False
-        
-        # Ensure that the stock has at least x years of positive P/E history
-        group.sort_values('date', inplace=True, ascending=False)
-        pe_ratios = group.groupby('year').first()['pe_ratio']  
-        if (pe_ratios > 0).sum() < criteria['years_positive_pe_history']:
-            valid = False
-        
-        # Get the latest P/E ratio and check if it meets the current P/E ratio criteria
-        latest_pe_ratio = current_ratios_row['pe_ratio'] if use_current_ratios else group.sort_values('date').iloc[-1]['pe_ratio']
-        if latest_pe_ratio >= criteria['max_current_pe_ratio']:
-            valid = False
-        
-        return valid
-    
-    # Group by symbol and apply the screening criteria
-    screened_symbols = df.groupby('symbol').filter(stock_meets_criteria)['symbol'].unique()
-    
+
+    # The heavy reduction is cached independently of the sidebar criteria
+    agg = compute_symbol_aggregates(df, current_df)
+    screened_symbols = apply_criteria(agg, criteria)
+
     # Filter the original DataFrame to include only the screened symbols
     filtered_df = df[df['symbol'].isin(screened_symbols)]
-    
+
     filtered_current_df = current_df[current_df['symbol'].isin(screened_symbols)]
-    
+
     return filtered_df, filtered_current_df
 
 def prepare_screener_results_preview(df, criteria) -> pd.DataFrame:
-    df = df.sort_values(by='date', ascending=False)
-    df = df.groupby('symbol').first().reset_index()
-    df.drop(columns=['year'], inplace=True)
+    # df is pre-sorted by (symbol, date), so the last row per group is the
+    # latest report — no re-sort needed
+    df = df.groupby('symbol', sort=False).tail(1).reset_index(drop=True)
+    df = df.drop(columns=['year'])
     df = df.rename(columns={
         'name': 'company_name',
         'date': 'last_quarterly_report_date',
@@ -126,21 +172,26 @@ def prepare_screener_results_preview(df, criteria) -> pd.DataFrame:
     return df
 
 def prepare_individual_stock_report(df, current_df, symbol) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # Rows for a single symbol are already in date order from load_data
     stock_data = df[df['symbol'] == symbol]
-    stock_data = stock_data.sort_values('date')
     most_recent_date = stock_data['date'].max()
-    avg_pb_3_year, avg_pb_max_year, available_years = calculate_avg_pb_ratios(stock_data)
+    avg_pb_3_year, avg_pb_max_year, available_years = calculate_avg_pb_ratios(stock_data['date'].values, stock_data['price_to_book_ratio'].values)
     
-    try:
-        current_ratios_row = current_df[current_df['symbol'] == symbol].iloc[0]
+    # O(1) lookup of the live ratios instead of a linear scan of current_df
+    current_lookup = current_df.set_index('symbol')[['pb_ratio', 'pe_ratio']].to_dict('index')
+    current_ratios_row = current_lookup.get(symbol)
+    if current_ratios_row is not None:
         latest_pb_ratio = current_ratios_row['pb_ratio']
         latest_pe_ratio = current_ratios_row['pe_ratio']
-    except:
+    else:
         latest_pb_ratio = stock_data[stock_data['date'] == most_recent_date]['price_to_book_ratio'].iloc[0]
         latest_pe_ratio = stock_data[stock_data['date'] == most_recent_date]['pe_ratio'].iloc[0]
-        
-    lower_avg_pb = min(avg_pb_3_year, avg_pb_max_year)
-    ratio = latest_pb_ratio / lower_avg_pb if lower_avg_pb != 0 else None
+
+
+    # nanmin so one NaN average (e.g. no P/B rows in the last 3 years) does not
+    # poison the comparison; Python's min() is order-dependent with NaN
+    lower_avg_pb = np.nanmin([avg_pb_3_year, avg_pb_max_year])
+    ratio = latest_pb_ratio / lower_avg_pb if lower_avg_pb != 0 and not np.isnan(lower_avg_pb) else None
 
     fundamentals_report_dict = {
         'Current P/E Ratio': latest_pe_ratio,
@@ -196,21 +247,58 @@ def download_stock_report_txt(symbol: str, company_name: str, time_series_data:
     return report_text
 
 
-# Function to load data from PostgreSQL and cache the connection for 30 minutes 
-@st.cache_data(ttl=1800)
-def load_data() -> tuple[pd.DataFrame, pd.DataFrame]:
-    # Connect to the PostgreSQL database
+# Cache the PostgreSQL connection once per process; st.cache_resource keeps the
+# TCP+TLS+auth handshake out of the data-loading hot path
+@st.cache_resource
+def get_db() -> PostgreSQL:
     db = PostgreSQL(db_name='sample_database', user='sample_user', password='sample_password', host='172.105.101.61', port='5432')
     db.connect()
-    
-    ratio_history_df = db.load_report_dataframe()
-    ratio_history_df.replace([np.inf, -np.inf], np.nan, inplace=True)
-    
+    return db
+
+
+# Function to load data from PostgreSQL and cache the result for 30 minutes
+@st.cache_data(ttl=1800)
+def load_data() -> tuple[pd.DataFrame, pd.DataFrame]:
+    db = get_db()
+
+    # The cached connection lives across reruns; recover it if a previous
+    # error closed it or left it in an aborted transaction
+    db.ensure_connection()
+
+    # COPY-based read: the full history table streams out as CSV instead of
+    # being materialized as row tuples by pd.read_sql
+    ratio_history_df = db.load_report_dataframe_fast()
     current_ratio_df = db.load_current_ratio_dataframe()
-    current_ratio_df.replace([np.inf, -np.inf, np.nan], 0, inplace=True)
-    
-    db.close()
-    
+
+    # Downcast the numeric columns to float32 (halves memory traffic for the
+    # reduction passes) and scrub non-finite values with one isfinite mask per
+    # column instead of a replace() match list
+    for c in ('price_to_book_ratio', 'pe_ratio', 'stock_price', 'book_value_per_share', 'ttm_net_eps'):
+        if c in ratio_history_df:
+            arr = ratio_history_df[c].to_numpy(dtype='float32')
+            arr[~np.isfinite(arr)] = np.nan
+            ratio_history_df[c] = arr
+
+    for c in ('pb_ratio', 'pe_ratio'):
+        arr = current_ratio_df[c].to_numpy(dtype='float32')
+        arr[~np.isfinite(arr)] = 0
+        current_ratio_df[c] = arr
+
+    # Categorical symbols turn the downstream .isin filters into integer-code
+    # compares and shrink the cached frames considerably
+    ratio_history_df['symbol'] = ratio_history_df['symbol'].astype('category')
+    current_ratio_df['symbol'] = current_ratio_df['symbol'].astype('category')
+
+    # Normalize the date column and precompute the report year here so the
+    # cached frame already carries them; screen_stocks must not mutate its
+    # cached inputs, and redoing the conversion per rerun defeats the cache
+    ratio_history_df['date'] = pd.to_datetime(ratio_history_df['date'])
+    ratio_history_df['year'] = ratio_history_df['date'].dt.year.astype('int16')
+
+    # Sort once by (symbol, date); every downstream consumer relies on this
+    # ordering instead of re-sorting per call
+    ratio_history_df = ratio_history_df.sort_values(['symbol', 'date'], kind='mergesort').reset_index(drop=True)
+
     return ratio_history_df, current_ratio_df
 
 
@@ -230,7 +318,9 @@ def main():
     
     years_pb_history = st.sidebar.number_input("Minimum Years of P/B History", min_value=1, value=7, max_value=10)
     only_positive_pb = st.sidebar.checkbox("Only Positive P/B History", value=True)
-    current_pb_ratio = st.sidebar.number_input("Maximum Current P/B Ratio", value=2.0, max_value=current_data['pb_ratio'].max())
+    # float() because the downcast column yields np.float32, which Streamlit
+    # rejects when mixed with the float default
+    current_pb_ratio = st.sidebar.number_input("Maximum Current P/B Ratio", value=2.0, max_value=float(current_data['pb_ratio'].max()))
     pb_margin_of_safety = st.sidebar.number_input("Margin of Safety Factor", value=1.0)
     
     st.sidebar.header("Price-to-Earnings Settings")
@@ -262,10 +352,18 @@ def main():
     # Display the filtered stocks
     st.dataframe(prepare_screener_results_preview(screener_results, criteria), hide_index=True, use_container_width=True)
     
+    # Render the per-symbol report as a fragment so picking a different symbol
+    # reruns only this block, not the whole screener script
+    render_symbol_report(screener_results, screener_current_results)
+
+
+# Fragment-scoped report: symbol changes don't trigger a full-page rerun
+@st.fragment
+def render_symbol_report(screener_results, screener_current_results):
     # Create a selectbox for stock selection below the screener results
     selected_symbol = st.selectbox('Select a screened stock symbol to view individual report:', screener_results['symbol'].unique())
     selected_name = screener_results[screener_results['symbol'] == selected_symbol]['name'].iloc[0]
-    
+
     # Generate and display the report for the selected stock as a dataframe
     if selected_symbol:
         time_series_report, fundamental_report = prepare_individual_stock_report(screener_results, screener_current_results, selected_symbol)
@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from yahoo_fin.stock_info import get_live_price
 
 from utils.misc import check_password
@@ -13,39 +14,47 @@ if 'df' not in st.session_state:
 if 'price_cache' not in st.session_state:
     st.session_state.price_cache = {}
 
+# Function to fetch live prices concurrently; each call is a blocking HTTPS
+# round-trip, so a thread pool overlaps the request latency across tickers
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_prices(tickers: tuple[str, ...]) -> dict:
+    with ThreadPoolExecutor(max_workers=16) as ex:
+        return dict(zip(tickers, ex.map(get_live_price, tickers)))
+
 # Function to check target prices
 def check_target_prices(df):
     current_prices = st.session_state.price_cache
-    for _, r in df.iterrows():
-        ticker = r['Ticker']
-        if len(str(ticker)) == 0 or ticker is None:
-            pass
-        elif ticker not in current_prices:
-            current_prices[ticker] = get_live_price(ticker)
-
-    df["Current Price"] = df["Ticker"].apply(lambda x: current_prices.get(x, 0) if current_prices.get(x) is not None else 0)
-    df["Reached Target"] = df["Current Price"] >= df["Target Price"]
+    missing = tuple(t for t in df["Ticker"].dropna().unique() if len(str(t)) > 0 and t not in current_prices)
+    if missing:
+        current_prices.update(_fetch_prices(missing))
+
+    # Map the prices in one vectorized pass; coerce failed fetches (None) to 0 first
+    clean = {k: (v or 0) for k, v in current_prices.items()}
+    df["Current Price"] = df["Ticker"].map(clean).fillna(0)
+    df["Reached Target"] = df["Current Price"].ge(df["Target Price"])
     return df[df["Reached Target"]]
 
 # Function to classify stocks by holding period
 def classify_by_holding_period(df):
-    today = datetime.today()
-    one_year_ago = today - timedelta(days=365)
-    two_years_ago = today - timedelta(days=730)
-    three_years_ago = today - timedelta(days=1095)
-    
+    today = pd.Timestamp.today()
+
     # Make sure that the Purchase Date column is a datetime
     df["Purchase Date"] = pd.to_datetime(df["Purchase Date"])
 
-    one_year_df = df[(df["Purchase Date"] <= one_year_ago) & (df["Purchase Date"] > two_years_ago) & (df["Debt Level"] == "HD")]
-    two_years_hd_df = df[(df["Purchase Date"] <= two_years_ago) & (df["Purchase Date"] > three_years_ago) & (df["Debt Level"] == "HD")]
-    two_years_ld_df = df[(df["Purchase Date"] <= two_years_ago) & (df["Purchase Date"] > three_years_ago) & (df["Debt Level"] == "LD")]
-    three_years_df = df[df["Purchase Date"] <= three_years_ago]
+    # Bucket every row in one pd.cut pass instead of four overlapping mask scans
+    bins = [pd.Timestamp.min, today - pd.Timedelta(days=1095), today - pd.Timedelta(days=730), today - pd.Timedelta(days=365), pd.Timestamp.max]
+    bucket = pd.cut(df["Purchase Date"], bins=bins, labels=["3y", "2y", "1y", "<1y"])
+
+    one_year_df = df[(bucket == "1y") & (df["Debt Level"] == "HD")]
+    two_years_hd_df = df[(bucket == "2y") & (df["Debt Level"] == "HD")]
+    two_years_ld_df = df[(bucket == "2y") & (df["Debt Level"] == "LD")]
+    three_years_df = df[bucket == "3y"]
 
     return one_year_df, two_years_hd_df, two_years_ld_df, three_years_df
 
-# Function to download template
-def download_template():
+# Function to build the template CSV once per process
+@st.cache_data
+def build_template_csv() -> bytes:
     sample_data = [
         ("AAPL", "2023-06-10", 200, "HD"),
         ("MHK", "2023-06-12", 135, "LD"),
@@ -55,9 +64,11 @@ def download_template():
         ("MSFT", "2022-07-25", 300, "LD")
     ]
     template_df = pd.DataFrame(sample_data, columns=["Ticker", "Purchase Date", "Target Price", "Debt Level"])
-    template_df.to_csv("template.txt", index=False)
-    with open("template.txt") as f:
-        st.download_button("Download Template", f, file_name="template.txt")
+    return template_df.to_csv(index=False).encode()
+
+# Function to download template; served straight from memory, no disk round-trip
+def download_template():
+    st.download_button("Download Template", build_template_csv(), file_name="template.txt", mime="text/csv")
 
 # Function to load uploaded file
 def load_uploaded_file(uploaded_file):
@@ -1,16 +1,63 @@
 import warnings; warnings.simplefilter(action='ignore', category=FutureWarning)
+import asyncio
+import numpy as np
 import pandas as pd
+import re
 import requests
+import aiohttp
+import time
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from functools import cached_property
 import random
-from bs4 import BeautifulSoup
+import lxml.html
 from fake_useragent import UserAgent
 from yahoo_fin.stock_info import tickers_nasdaq, get_data
 
+# Compiled once; strips dollar signs and thousands separators from numeric columns
+_dollar_re = re.compile(r'[\$,]')
+
+
+def _parse_cell(text: str) -> float:
+    """Parse one table cell to a float, treating blanks/dashes as NaN."""
+    try:
+        return float(_dollar_re.sub('', text))
+    except ValueError:
+        return np.nan
+
+
+def _numeric_array(cells: tuple) -> np.ndarray:
+    """Convert a column of table cells straight to float32 in a single pass."""
+    return np.fromiter((_parse_cell(t) for t in cells), dtype=np.float32, count=len(cells))
+
+
+def _date_array(cells: tuple) -> np.ndarray:
+    """Convert ISO date strings to datetime64[D]; malformed cells become NaT."""
+    out = np.empty(len(cells), dtype='datetime64[D]')
+    for i, t in enumerate(cells):
+        try:
+            out[i] = np.datetime64(t.strip(), 'D')
+        except ValueError:
+            out[i] = np.datetime64('NaT')
+    return out
+
 
 class StockDataAPI:
     def __init__(self) -> None:
-        pass
+        # Reuse one pooled session so every request rides a keep-alive connection
+        # instead of paying a fresh TCP+TLS handshake
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # Pick one random user agent per session rather than per request
+        self._ua = UserAgent().random
     
     def get_exchange_tickers(self, exchanges: list[str], randomized: bool = True) -> set:
         """
@@ -37,7 +84,7 @@ class StockDataAPI:
                     'referer': 'https://www.nasdaq.com/',
                     'accept-language': 'en-US,en;q=0.9',
                 }
-                r = requests.get("https://api.nasdaq.com/api/screener/stocks?exchange=nyse&download=true", headers=headers).json()
+                r = self.session.get("https://api.nasdaq.com/api/screener/stocks?exchange=nyse&download=true", headers=headers).json()
                 tickers.update([row['symbol'] for row in r['data']['rows']])
             else:
                 raise NotImplementedError("Exchange must be either 'nasdaq' or 'nyse'")
@@ -69,27 +116,23 @@ class StockDataAPI:
         - DataFrame: The P/E ratio history for the stock.
         - float: The current P/E ratio for the stock.
         """
-        r = requests.get(f"https://www.macrotrends.net/stocks/charts/{macrotrends_url}/pe-ratio",
+        r = self.session.get(f"https://www.macrotrends.net/stocks/charts/{macrotrends_url}/pe-ratio",
                         headers=self._request_headers)
-        
-        # Parsing the response content with BeautifulSoup
-        soup = BeautifulSoup(r.content, 'html.parser')
-        table = soup.find('table')
-        
-        # Extract the latest P/E ratio element
-        pe_ratio_element = soup.select_one('#main_content > div:nth-of-type(2) > span > p:nth-of-type(1) > strong')
-        current_pe_ratio = float(pe_ratio_element.text)
-        
-        # Read the table and skip the first row
-        df = pd.read_html(str(table), header=1)[0]
-        
+
+        return self._build_pe_history(r.content)
+
+    def _build_pe_history(self, content: bytes) -> tuple[pd.DataFrame, float]:
+        # Parse the page (current ratio + history table) in a single lxml pass
+        df, current_pe_ratio = self._parse_ratio_page(content)
+
         # Rename all columns by doing lowercase and replacing spaces with underscores
         df.columns = [col.lower().replace(' ', '_') for col in df.columns]
-        df['date'] = pd.to_datetime(df['date'])
-        df['ttm_net_eps'] = df['ttm_net_eps'].replace('[\$,]', '', regex=True).astype(float)
-        
+        # Second resolution is plenty for daily data and matches the P/B frame
+        # so the merge keys line up
+        df['date'] = pd.to_datetime(df['date']).astype('datetime64[s]')
+
         df.drop(['stock_price'], inplace=True, axis=1)
-                
+
         return df, current_pe_ratio
         
     def get_pb_ratio_history(self, symbol: str, company_name: str, macrotrends_url: str) -> tuple[pd.DataFrame, float]:
@@ -100,20 +143,15 @@ class StockDataAPI:
         - DataFrame: The P/B ratio history for the stock.
         - float: The current P/B ratio for the stock.
         """
-        r = requests.get(f"https://www.macrotrends.net/stocks/charts/{macrotrends_url}/price-book",
+        r = self.session.get(f"https://www.macrotrends.net/stocks/charts/{macrotrends_url}/price-book",
                         headers=self._request_headers)
-        
-        # Parsing the response content with BeautifulSoup
-        soup = BeautifulSoup(r.content, 'html.parser')
-        table = soup.find('table')
-        
-        # Get the latest P/B ratio
-        pb_ratio_element = soup.select_one('#main_content > div:nth-child(2) > span > p:nth-child(1) > strong')
-        current_pb_ratio = float(pb_ratio_element.text)
-        
-        # Read the table and skip the first row
-        df = pd.read_html(str(table), header=1)[0]
-        
+
+        return self._build_pb_history(r.content, symbol, company_name)
+
+    def _build_pb_history(self, content: bytes, symbol: str, company_name: str) -> tuple[pd.DataFrame, float]:
+        # Parse the page (current ratio + history table) in a single lxml pass
+        df, current_pb_ratio = self._parse_ratio_page(content)
+
         # Rename columns
         new_columns = {
             'Date': 'date',
@@ -123,40 +161,108 @@ class StockDataAPI:
         }
         df.rename(columns=new_columns, inplace=True)
         
-        # Clean the data
-        df['date'] = pd.to_datetime(df['date'], errors='coerce')  # Convert to datetime, coerce errors to NaT
+        # Clean the data; numeric columns are already float32 from the parse.
+        # Second resolution is plenty for daily data and halves the key width
+        df['date'] = pd.to_datetime(df['date'], errors='coerce').astype('datetime64[s]')
         df = df.dropna(subset=['date'])  # Drop rows where date conversion failed
-        
-        # Ensure other columns are cleaned
-        df['stock_price'] = df['stock_price'].replace('[\$,]', '', regex=True).astype(float)
-        df['book_value_per_share'] = df['book_value_per_share'].replace('[\$,]', '', regex=True).astype(float)
-        df['price_to_book_ratio'] = df['price_to_book_ratio'].astype(float)
-        
-        # Append metadata
-        df['symbol'] = symbol
-        df['name'] = company_name
+
+        # Append metadata; dictionary-encoded since both columns repeat one value
+        df['symbol'] = pd.Categorical([symbol] * len(df))
+        df['name'] = pd.Categorical([company_name] * len(df))
         columns_order = ['symbol', 'name'] + [col for col in df.columns if col not in ['symbol', 'name']]
         df = df[columns_order]
                 
         return df, current_pb_ratio
     
+    def _parse_ratio_page(self, content: bytes) -> tuple[pd.DataFrame, float]:
+        """
+        Parse a Macrotrends ratio page in a single lxml pass.
+
+        :returns: (DataFrame, float)
+        - DataFrame: The history table with its original column headers, dates
+          parsed as datetime64 and numeric columns as float32.
+        - float: The current ratio quoted in the page header.
+        """
+        doc = lxml.html.fromstring(content)
+
+        # Extract the latest ratio element from the header blurb
+        current_ratio = float(doc.xpath('//*[@id="main_content"]/div[2]/span/p[1]/strong')[0].text_content())
+
+        # First table on the page; the last header row holds the column names
+        table = doc.xpath('//table')[0]
+        headers = [th.text_content().strip() for th in table.xpath('.//tr[th]')[-1].xpath('./th')]
+        data = [[td.text_content() for td in tr.xpath('./td')] for tr in table.xpath('.//tr[td]')]
+
+        # Convert each column straight to its numpy dtype — one pass per column
+        # instead of a string frame followed by regex replace + astype
+        frame = {}
+        for header, cells in zip(headers, zip(*data)):
+            frame[header] = _date_array(cells) if header == 'Date' else _numeric_array(cells)
+
+        return pd.DataFrame(frame), current_ratio
+
     @cached_property
     def all_macrotrends_tickers(self) -> pd.DataFrame:
-        r = requests.get("https://www.macrotrends.net/assets/php/ticker_search_list.php", 
+        # The ticker list changes daily at most; keep a Parquet copy on disk so
+        # process restarts (poller retries, fresh Streamlit workers) skip the
+        # fetch + JSON parse and load via Arrow in milliseconds
+        cache_path = Path('~/.cache/macrotrends_tickers.parquet').expanduser()
+        if cache_path.is_file() and time.time() - cache_path.stat().st_mtime < 24 * 3600:
+            return pd.read_parquet(cache_path)
+
+        r = self.session.get("https://www.macrotrends.net/assets/php/ticker_search_list.php",
                          headers=self._request_headers).json()
-        
-        return pd.DataFrame.from_records(
-            (
-                {
-                    'symbol': company['n'].split(' - ')[0],
-                    'name': company['s'].split('/')[1],
-                    'full_name': company['n'].split(' - ')[1],
-                    'url': company['s']
-                }
-                for company in r
-            )
-        )
+
+        # Tokenize with pandas' vectorized str kernels — one allocation per
+        # column instead of Python-level splits per row
+        raw = pd.DataFrame(r)
+        ns = raw['n'].str.split(' - ', n=1, expand=True)
+        ss = raw['s'].str.split('/', n=1, expand=True)
+        df = pd.DataFrame({'symbol': ns[0], 'name': ss[1], 'full_name': ns[1], 'url': raw['s']})
+
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(cache_path, compression='zstd')
+
+        return df
         
     @property
     def _request_headers(self):
-        return {'User-Agent': UserAgent().random}
\ No newline at end of file
+        return {'User-Agent': self._ua}
+
+
+class StockDataAPIAsync(StockDataAPI):
+    """
+    aiohttp-backed counterpart to StockDataAPI for the polling pipeline: the
+    ratio-history fetches become coroutines sharing one pooled ClientSession,
+    and the lxml parsing runs in a worker thread so it overlaps with the next
+    fetch. Ticker listing still goes through the inherited sync methods.
+    """
+    def __init__(self, max_connections: int = 32) -> None:
+        super().__init__()
+        self._connector_limit = max_connections
+        self._asession = None
+
+    async def __aenter__(self):
+        self._asession = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self._connector_limit),
+            headers=self._request_headers
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self._asession.close()
+
+    async def _fetch(self, url: str) -> bytes:
+        async with self._asession.get(url) as resp:
+            resp.raise_for_status()
+            return await resp.read()
+
+    async def get_pe_ratio_history(self, symbol: str, company_name: str, macrotrends_url: str) -> tuple[pd.DataFrame, float]:
+        """Async version of StockDataAPI.get_pe_ratio_history."""
+        content = await self._fetch(f"https://www.macrotrends.net/stocks/charts/{macrotrends_url}/pe-ratio")
+        return await asyncio.get_running_loop().run_in_executor(None, self._build_pe_history, content)
+
+    async def get_pb_ratio_history(self, symbol: str, company_name: str, macrotrends_url: str) -> tuple[pd.DataFrame, float]:
+        """Async version of StockDataAPI.get_pb_ratio_history."""
+        content = await self._fetch(f"https://www.macrotrends.net/stocks/charts/{macrotrends_url}/price-book")
+        return await asyncio.get_running_loop().run_in_executor(None, self._build_pb_history, content, symbol, company_name)
\ No newline at end of file
@@ -1,136 +1,309 @@
+import asyncio
+import logging
 import time
 import random
 import pandas as pd
+from datetime import datetime, timezone
+from pathlib import Path
+from queue import Queue
+from threading import Thread
 
-from pipeline.api import StockDataAPI
+from pipeline.api import StockDataAPIAsync
 from pipeline.db import PostgreSQL
 from utils.logger import logger
 
 CHUNK_SIZE = 10
+FLUSH_RETRIES = 3  # Store attempts per batch before it is sidelined to disk
+
+
+class TokenBucket:
+    """
+    Async token-bucket rate limiter shared by all in-flight workers: bursts
+    draw tokens immediately, and acquire() only sleeps once the bucket runs
+    empty, so the connection stays busy instead of idling between tickers.
+    """
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate  # Tokens replenished per second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
 
 
 class DataPoller:
     def __init__(self,
-                 macrotrends_api: StockDataAPI,
+                 macrotrends_api: StockDataAPIAsync,
                  exchanges: list[str] = ["nasdaq", "nyse"],
-                 base_ratelimit: int = 10, 
-                 ratelimit_buffer: tuple[float] = (0.0, 1.0)) -> None:
+                 base_ratelimit: int = 10,
+                 ratelimit_buffer: tuple[float] = (0.0, 1.0),
+                 max_concurrency: int = 16) -> None:
         self.exchanges = exchanges
         self.base_ratelimit = base_ratelimit
-        self.ratelimit_buffer = ratelimit_buffer  # Used to add some unpredictability to the request timing
+        self.ratelimit_buffer = ratelimit_buffer  # Jitter applied after a 429 response
+        self.max_concurrency = max_concurrency  # Upper bound on in-flight ticker fetches
         self.api = macrotrends_api
-        
-    def do_sleep(self) -> None:
+
+        # One bucket across all workers: 1 request per base_ratelimit seconds
+        # on average, with a small burst allowance
+        self.ratelimit = TokenBucket(rate=1 / base_ratelimit, burst=4)
+
+        # Persistent database handle, connected lazily and kept across retries
+        # of run(); all writes flow through the single writer thread, so one
+        # connection is enough — no pool needed
+        self.database = PostgreSQL(db_name='sample_database',
+                                   user='sample_user',
+                                   password='sample_password',
+                                   host='172.105.101.61',
+                                   port='5432')
+
+        # Bounded hand-off queue to the database writer thread: fetching keeps
+        # going while a batch is being stored, and put() blocking on a full
+        # queue back-pressures the fetchers if the database falls behind
+        self._db_q = Queue(maxsize=4)
+        self._db_thread = Thread(target=self._db_worker, daemon=True)
+        self._db_thread.start()
+
+    def _db_worker(self) -> None:
+        """
+        Writer thread: pops (hist_df, current_rows) batches off the queue and
+        stores them, so the psycopg2 round-trips overlap with fetching instead
+        of stalling the event loop. A None sentinel shuts it down.
+        """
+        while True:
+            batch = self._db_q.get()
+            try:
+                if batch is None:
+                    return
+                hist_df, current_rows = batch
+
+                def store_hist() -> None:
+                    # COPY through the staging table — the fastest path for
+                    # the consolidated CHUNK_SIZE batches
+                    self._get_database().store_report_copy([hist_df])
+                    logger.debug("Stored historical ratio data for %d tickers.", len(current_rows))
+
+                def store_current() -> None:
+                    self._get_database().store_current_ratio_tuples(current_rows)
+                    logger.debug("Stored current ratio data for %d tickers.", len(current_rows))
+
+                self._store_or_sideline(store_hist, hist_df, 'hist')
+                self._store_or_sideline(
+                    store_current,
+                    pd.DataFrame(current_rows, columns=['symbol', 'last_update', 'pb_ratio', 'pe_ratio']),
+                    'current'
+                )
+            except Exception:
+                # The writer must never die while producers are running: a dead
+                # consumer leaves flush() blocked forever on the full queue.
+                # Worst case here is one lost batch (e.g. the sideline write
+                # itself failed), which is logged loudly
+                logger.error("Database writer failed to process a batch:", exc_info=True)
+            finally:
+                self._db_q.task_done()
+
+    def _store_or_sideline(self, store, sideline_df: pd.DataFrame, kind: str) -> None:
+        """
+        Run a store callable with a few retries; if every attempt fails, dump
+        the batch to a Parquet sideline file so it can be replayed later
+        instead of being dropped on the floor.
         """
-        Sleep for a random time between the base ratelimit and the buffer range.
+        for attempt in range(1, FLUSH_RETRIES + 1):
+            try:
+                store()
+                return
+            except Exception:
+                logger.warning("Store attempt %d/%d for the %s batch failed:",
+                               attempt, FLUSH_RETRIES, kind, exc_info=True)
+                time.sleep(2 ** attempt)
+
+        sideline_dir = Path('~/.cache/poller_sideline').expanduser()
+        sideline_dir.mkdir(parents=True, exist_ok=True)
+        out = sideline_dir / f"{kind}_{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}.parquet"
+        sideline_df.to_parquet(out, compression='zstd')
+        logger.error("Sidelined %d %s rows to %s after %d failed store attempts.",
+                     len(sideline_df), kind, out, FLUSH_RETRIES)
+
+    def _get_database(self) -> PostgreSQL:
+        """Connect (or reconnect) the persistent database handle on demand."""
+        if self.database.conn is None or self.database.conn.closed:
+            self.database.connect()
+            self.database.ensure_schema()
+        return self.database
+
+    def _get_exchange_tickers_cached(self) -> pd.DataFrame:
+        """
+        Disk-cached wrapper around get_exchange_tickers: retries of run() reuse
+        the scraped ticker list for a day instead of repeating the scrape.
+        """
+        cache_path = Path('~/.cache/exchange_tickers.parquet').expanduser()
+        if cache_path.is_file() and time.time() - cache_path.stat().st_mtime < 24 * 3600:
+            return pd.read_parquet(cache_path)
+
+        df = self.api.get_exchange_tickers(self.exchanges)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(cache_path, compression='zstd')
+
+        return df
+
+    async def _fetch_ticker(self, sem: asyncio.Semaphore, symbol: str, full_name: str, url: str):
+        """
+        Fetch and merge the P/B and P/E history for a single ticker under the
+        concurrency bound. Returns (history_df, current_ratio_row) or None if
+        the ticker could not be fetched.
+        """
+        async with sem:
+            # Get the P/B history
+            try:
+                await self.ratelimit.acquire()
+                pb_history_df, current_pb = await self.api.get_pb_ratio_history(symbol, full_name, url)
+
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Fetched %d P/B history records for %s (%s)", len(pb_history_df), symbol, full_name)
+            except Exception as e:
+                logger.warning("Could not fetch P/B history for %s: %s", url, e)
+                if getattr(e, 'status', None) == 429:
+                    await asyncio.sleep(random.uniform(*self.ratelimit_buffer))
+                # Skip this ticker because we need the P/B history df as a foundation
+                return None
+
+            # Get the P/E history
+            try:
+                await self.ratelimit.acquire()
+                pe_history_df, current_pe = await self.api.get_pe_ratio_history(symbol, full_name, url)
+
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Fetched %d P/E history records for %s (%s)", len(pe_history_df), symbol, full_name)
+            except Exception as e:
+                logger.warning("Could not fetch P/E history for %s: %s", url, e)
+                if getattr(e, 'status', None) == 429:
+                    await asyncio.sleep(random.uniform(*self.ratelimit_buffer))
+                return None
+
+        # Merge the P/B and P/E history on date — a single hash join, with no
+        # index construction/teardown around it. No sort: insertion order is
+        # irrelevant to the database, and reads are ordered by the
+        # (symbol, date DESC) index
+        try:
+            concat_df = pd.merge(pb_history_df, pe_history_df, on='date', how='outer')
+            # Keep date as the leading column — the insert binds positionally
+            concat_df.insert(0, 'date', concat_df.pop('date'))
+        except Exception as e:
+            logger.warning("Could not merge P/B and P/E history for %s (%s): %s", symbol, full_name, e)
+            return None
+
+        # Build the row for current P/B and P/E as a plain tuple:
+        # Symbol, Last_Update, PB_Ratio, PE_Ratio. A stdlib UTC datetime is
+        # cheaper than a pd.Timestamp and unambiguous across poller hosts
+        current_row = (symbol, datetime.now(timezone.utc), current_pb, current_pe)
+
+        return concat_df, current_row
+
+    async def poll_tickers_async(self) -> None:
         """
-        time.sleep(self.base_ratelimit + random.uniform(*self.ratelimit_buffer))
-        
-    def poll_tickers(self) -> None:
+        Poll all tickers for P/B & P/E from the exchanges and store them in the
+        database. Fetches run concurrently (bounded by max_concurrency); results
+        are consumed and written to the database from this single task so
+        psycopg2 stays single-threaded.
         """
-        Poll all tickers for P/B from the exchanges and store them in the database.
-        """        
-        
+
         # Get all tickers from the exchanges
         try:
-            logger.debug(f"Fetching exchange tickers ({self.exchanges})")
-        
-            # Fetch all tickers from the exchanges
-            all_tickers_df = self.api.get_exchange_tickers(self.exchanges)
+            logger.debug("Fetching exchange tickers (%s)", self.exchanges)
+
+            # Fetch all tickers from the exchanges (disk-cached across retries)
+            all_tickers_df = self._get_exchange_tickers_cached()
+
+            # Dictionary-encode the repeated strings: the codes array is a
+            # narrow int and the values come back interned during iteration
+            for c in ('symbol', 'full_name'):
+                all_tickers_df[c] = all_tickers_df[c].astype('category')
         except Exception as e:
             raise Exception(f"Error occurred when fetching exchange tickers ({self.exchanges}):", e)
-        
-        # Instantiate a new database connection
-        with PostgreSQL(db_name='sample_database', 
-                        user='sample_user', 
-                        password='sample_password', 
-                        host='172.105.101.61',
-                        port='5432') as database:
-            logger.debug(f"P/B & P/E Polling started for {len(all_tickers_df)} tickers. Est. time: ~{(len(all_tickers_df) * 20)/3600:.1f} hours.")
-            
-            ratio_history_df_chunk = []
-            current_ratio_rows = []
-            for i, r in all_tickers_df.iterrows():
-                # Get the P/B history
-                try:
-                    pb_history_df, current_pb = self.api.get_pb_ratio_history(r['symbol'], r['full_name'], r['url'])
 
-                    logger.debug(f"({i+1}/{len(all_tickers_df)}) Fetched {len(pb_history_df)} P/B history records for {r['symbol']} ({r['full_name']})")
-                    
-                    # Sleep for the ratelimit
-                    self.do_sleep()
-                except Exception as e:
-                    logger.warn(f"Could not fetch P/B history for {r['url']}:", e)
-                    # Skip this ticker because we need the P/B history df as a foundation
+        # Connect and check the schema up front (retries of run() reuse the
+        # connection); after this point only the writer thread touches it
+        self._get_database()
+
+        logger.debug("P/B & P/E Polling started for %d tickers (%d concurrent). Est. time: ~%.1f hours.",
+                     len(all_tickers_df), self.max_concurrency, (len(all_tickers_df) * 20) / (3600 * self.max_concurrency))
+
+        sem = asyncio.Semaphore(self.max_concurrency)
+        async with self.api:
+            # itertuples avoids the per-row Series construction of iterrows
+            tasks = [
+                asyncio.create_task(self._fetch_ticker(sem, r.symbol, r.full_name, r.url))
+                for r in all_tickers_df.itertuples(index=False, name='Ticker')
+            ]
+
+            completed = 0
+            hist_chunk = []
+            current_rows = []
+
+            def flush() -> None:
+                # Hand the batch to the writer thread. The per-ticker frames
+                # are consolidated with one concat so the tuple conversion
+                # runs over a single block; put() blocks while the queue is
+                # full, throttling the fetchers to the database's pace
+                self._db_q.put((pd.concat(hist_chunk, copy=False), list(current_rows)))
+                hist_chunk.clear()
+                current_rows.clear()
+
+            for fut in asyncio.as_completed(tasks):
+                result = await fut
+                completed += 1
+                if result is None:
                     continue
-                
-                # Get the P/E history
-                try:
-                    pe_history_df, current_pe = self.api.get_pe_ratio_history(r['symbol'], r['full_name'], r['url'])
-                    
-                    logger.debug(f"({i+1}/{len(all_tickers_df)}) Fetched {len(pe_history_df)} P/E history records for {r['symbol']} ({r['full_name']})")
-                    
-                    # Sleep for the ratelimit
-                    self.do_sleep()
-                except Exception as e:
-                    logger.warn(f"Could not fetch P/B history for {r['url']}:", e)
-                    # Sleep for the ratelimit
-                    self.do_sleep()
-                    
-                # Concatenate the P/B and P/E history
-                try:
-                    concat_df = pd.concat([pb_history_df.set_index('date'), pe_history_df.set_index('date')], axis=1).reset_index()
-                    concat_df.sort_values('date', inplace=True, ascending=False)
-                    ratio_history_df_chunk.append(concat_df)
-                except Exception as e:
-                    logger.warn(f"Could not concatenate P/B and P/E history for {r['symbol']} ({r['full_name']}):", e)
-                    
-                # Build the row for current P/B and P/E
-                # Symbol, Last_Update, PB_Ratio, PE_Ratio
-                current_ratio_rows.append({
-                    'symbol': r['symbol'],
-                    'last_update': pd.Timestamp.now(),
-                    'pb_ratio': current_pb,
-                    'pe_ratio': current_pe
-                })
-                
-                # store the dataframes immediately
-                try:
-                    database.store_report_dataframes([concat_df])
-                    logger.debug(f"Stored historical ratio data for {r['symbol']} ({r['full_name']}).")
-                except Exception as e:
-                    logger.warning(f"An error occurred when storing historical ratio data for {r['symbol']} ({r['full_name']}):", exc_info=e)
-                finally:
-                    ratio_history_df_chunk.clear()                    
-                    
-                try:
-                    database.store_current_ratio_dataframes([pd.DataFrame(current_ratio_rows)])
-                    logger.debug(f"Stored current ratio data for {r['symbol']} ({r['full_name']}).")
-                except Exception as e:
-                    logger.warning(f"An error occurred when storing current ratio data for {r['symbol']} ({r['full_name']}):", exc_info=e)
-                finally:
-                    current_ratio_rows.clear()
-                    
-    
+                concat_df, current_row = result
+                hist_chunk.append(concat_df)
+                current_rows.append(current_row)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("(%d/%d) Fetched ratio data for %s.", completed, len(tasks), current_row[0])
+
+                # Flush every CHUNK_SIZE tickers to amortize the commit cost
+                if len(current_rows) >= CHUNK_SIZE:
+                    flush()
+
+            # Flush whatever remains from the final partial chunk, then wait
+            # for the writer thread to drain the queue before reporting done
+            if hist_chunk or current_rows:
+                flush()
+            self._db_q.join()
+
     def run(self) -> None:
         max_retries = 5  # Maximum number of retries
         base_wait_time = 5  # Base wait time in seconds
 
         retries = 0
-        while True:
-            try:
-                self.poll_tickers()
-                retries = 0  # Reset retries on successful polling
-            except KeyboardInterrupt:
-                logger.info("Polling stopped by user.")
-                break
-            except Exception as e:
-                logger.error("Error occurred during ticker polling:", exc_info=True)
-                retries += 1
-                if retries > max_retries:
-                    logger.error("Maximum retries reached. Exiting.")
+        try:
+            while True:
+                try:
+                    asyncio.run(self.poll_tickers_async())
+                    retries = 0  # Reset retries on successful polling
+                except KeyboardInterrupt:
+                    logger.info("Polling stopped by user.")
                     break
-                wait_time = base_wait_time * (2 ** retries)
-                logger.info(f"Retrying in {wait_time} seconds...")
-                time.sleep(wait_time)
-            
\ No newline at end of file
+                except Exception as e:
+                    logger.error("Error occurred during ticker polling:", exc_info=True)
+                    retries += 1
+                    if retries > max_retries:
+                        logger.error("Maximum retries reached. Exiting.")
+                        break
+                    wait_time = base_wait_time * (2 ** retries)
+                    logger.info("Retrying in %d seconds...", wait_time)
+                    time.sleep(wait_time)
+        finally:
+            # Stop the writer thread with the sentinel before closing the
+            # connection it writes through
+            self._db_q.put(None)
+            self._db_thread.join()
+            if self.database.conn is not None:
+                self.database.close()
@@ -1,11 +1,22 @@
 import warnings; warnings.simplefilter(action='ignore', category=UserWarning)
+import csv
+import io
+import numpy as np
 import psycopg2
+from psycopg2.extensions import register_adapter, Float
+from psycopg2.extras import execute_batch
 import pandas as pd
 from typing import Dict
 from contextlib import contextmanager
 
 from utils.logger import logger
 
+# The history frames carry float32 columns, so itertuples hands numpy scalars
+# to psycopg2, which can only adapt float64 (it subclasses Python float).
+# Teach it the rest; Float also renders NaN as a valid SQL literal
+for _np_float in (np.float32, np.float64):
+    register_adapter(_np_float, lambda v: Float(float(v)))
+
 class PostgreSQL:
     def __init__(self, db_name: str, user: str, password: str, host: str, port: str) -> None:
         self.db_name = db_name
@@ -15,6 +26,7 @@ class PostgreSQL:
         self.port = port
         self.conn = None
         self.cursor = None
+        self._statements_prepared = False
 
     def connect(self) -> None:
         """Establish a connection to the PostgreSQL database."""
@@ -27,10 +39,39 @@ class PostgreSQL:
                 port=self.port
             )
             self.cursor = self.conn.cursor()
+            self._statements_prepared = False  # Prepared statements are session-scoped
             logger.info("Connected to the database successfully.")
         except Exception as e:
             raise Exception(f"Error connecting to the {self.db_name} database: {e}")
 
+    def _ensure_prepared(self) -> None:
+        """
+        PREPARE the hot-path inserts once per connection, so Postgres parses
+        and plans each statement a single time and the store methods only
+        stream Bind/Execute against the saved plans. Lazy because the tables
+        must exist before the statements can be planned.
+        """
+        if self._statements_prepared:
+            return
+
+        self.cursor.execute('''
+        PREPARE ins_hist (DATE, VARCHAR, VARCHAR, FLOAT, FLOAT, FLOAT, FLOAT, FLOAT) AS
+        INSERT INTO macrotrends_pe_pb_hist (Date, Symbol, Name, Stock_Price, Book_Value_per_Share, Price_to_Book_Ratio, TTM_Net_EPS, PE_Ratio)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+        ON CONFLICT (Symbol, Date) DO NOTHING;
+        ''')
+        self.cursor.execute('''
+        PREPARE ins_cur (VARCHAR, TIMESTAMP, FLOAT, FLOAT) AS
+        INSERT INTO current_ratios (Symbol, Last_Update, PB_Ratio, PE_Ratio)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (Symbol)
+        DO UPDATE SET
+            PB_Ratio = EXCLUDED.PB_Ratio,
+            PE_Ratio = EXCLUDED.PE_Ratio,
+            Last_Update = EXCLUDED.Last_Update;
+        ''')
+        self._statements_prepared = True
+
     @contextmanager
     def transaction(self):
         """
@@ -42,12 +83,26 @@ class PostgreSQL:
             self.conn.commit()
         except Exception as e:
             self.conn.rollback()
-            logger.error(f"Transaction failed, rolling back. Error: {e}")
+            # PREPARE is transactional: statements planned inside a rolled-back
+            # transaction are gone, so force a re-prepare on the next store
+            self._statements_prepared = False
+            logger.error("Transaction failed, rolling back. Error: %s", e)
             raise
     
-    def prepare_tuples(self, df: pd.DataFrame) -> list:
-        """Convert a DataFrame to a list of tuples."""
-        return list(df.itertuples(index=False, name=None))
+    def prepare_tuples(self, df: pd.DataFrame):
+        """Yield the DataFrame rows as plain tuples without materializing a list."""
+        return df.itertuples(index=False, name=None)
+
+    def ensure_connection(self) -> None:
+        """
+        Make the connection usable again if it was closed or left in an
+        aborted transaction by an earlier error; long-lived callers (the
+        cached Streamlit handle, the poller) call this before reads.
+        """
+        if self.conn is None or self.conn.closed:
+            self.connect()
+        elif self.conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            self.conn.rollback()
 
     def close(self) -> None:
         """Close the database connection."""
@@ -74,28 +129,67 @@ class PostgreSQL:
             CONSTRAINT unique_symbol_date UNIQUE (Symbol, Date)
         );
         '''
+        create_index_query = '''
+        CREATE INDEX IF NOT EXISTS idx_hist_symbol_date
+        ON macrotrends_pe_pb_hist (Symbol, Date DESC);
+        '''
         try:
             with self.transaction():
                 self.cursor.execute(create_table_query)
-            logger.info(f"macrotrends_pe_pb_hist table created successfully.")
+                self.cursor.execute(create_index_query)
+            logger.info("macrotrends_pe_pb_hist table created successfully.")
         except Exception as e:
             raise Exception(f"Error creating macrotrends_pe_pb_hist table: {e}")
 
     def store_report_dataframes(self, dataframes: list[pd.DataFrame]) -> None:
         """Store multiple DataFrames in the PostgreSQL table."""
-        insert_query = '''
-        INSERT INTO macrotrends_pe_pb_hist (Date, Symbol, Name, Stock_Price, Book_Value_per_Share, Price_to_Book_Ratio, TTM_Net_EPS, PE_Ratio) 
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (Symbol, Date) DO NOTHING
-        '''
-        
         all_data = []
         for df in dataframes:
             all_data.extend(self.prepare_tuples(df))
-        
+
         with self.transaction():
-            self.cursor.executemany(insert_query, all_data)
-            logger.info(f"Sent {len(all_data)} rows to 'macrotrends_pe_pb_hist' table.")
+            # Bind/Execute against the prepared plan, batched into pages so a
+            # page of rows costs one round-trip and zero re-planning
+            self._ensure_prepared()
+            execute_batch(self.cursor, "EXECUTE ins_hist (%s, %s, %s, %s, %s, %s, %s, %s)", all_data, page_size=1000)
+            logger.info("Sent %d rows to 'macrotrends_pe_pb_hist' table.", len(all_data))
+
+    def store_report_copy(self, dataframes: list[pd.DataFrame]) -> None:
+        """
+        Bulk-load history rows with COPY into a temp staging table, then merge
+        them with ON CONFLICT DO NOTHING. Much faster than multi-VALUES inserts
+        once many tickers are flushed together.
+        """
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        n_rows = 0
+        for df in dataframes:
+            # Missing values must land as empty CSV fields (NULL): csv.writer
+            # would otherwise emit literal 'NaT'/'nan' strings, which COPY
+            # cannot parse into DATE columns
+            writer.writerows(
+                tuple(v if v == v else None for v in row)
+                for row in self.prepare_tuples(df)
+            )
+            n_rows += len(df)
+        buf.seek(0)
+
+        with self.transaction():
+            self.cursor.execute('''
+            CREATE TEMP TABLE macrotrends_pe_pb_hist_stage
+            (LIKE macrotrends_pe_pb_hist INCLUDING DEFAULTS)
+            ON COMMIT DROP;
+            ''')
+            self.cursor.copy_expert(
+                "COPY macrotrends_pe_pb_hist_stage (Date, Symbol, Name, Stock_Price, Book_Value_per_Share, Price_to_Book_Ratio, TTM_Net_EPS, PE_Ratio) FROM STDIN WITH CSV",
+                buf
+            )
+            self.cursor.execute('''
+            INSERT INTO macrotrends_pe_pb_hist
+            SELECT * FROM macrotrends_pe_pb_hist_stage
+            ON CONFLICT (Symbol, Date) DO NOTHING;
+            ''')
+            logger.info("Copied %d rows into 'macrotrends_pe_pb_hist' table.", n_rows)
 
     def load_report_dataframe(self, symbol: str = None) -> pd.DataFrame:
         """Load data from the PostgreSQL table."""
@@ -108,9 +202,36 @@ class PostgreSQL:
             df = pd.read_sql(query, self.conn, params=(symbol,))
             return df
         except Exception as e:
-            logger.error(f"Error loading data from the macrotrends_pe_pb_hist table: {e}")
+            logger.error("Error loading data from the macrotrends_pe_pb_hist table: %s", e)
             return pd.DataFrame()
-        
+
+    def load_report_dataframe_fast(self, symbol: str = None) -> pd.DataFrame:
+        """
+        Bulk read via COPY ... TO STDOUT instead of pd.read_sql: the rows
+        stream out as CSV straight into pandas' C parser, without a Python
+        tuple being allocated per row on the way.
+        """
+        if symbol is None:
+            query = 'SELECT * FROM macrotrends_pe_pb_hist'
+        else:
+            # COPY takes no bind parameters, so quote the symbol client-side
+            query = self.cursor.mogrify('SELECT * FROM macrotrends_pe_pb_hist WHERE Symbol = %s', (symbol,)).decode()
+
+        try:
+            buf = io.BytesIO()
+            self.cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH CSV HEADER", buf)
+            # End the read transaction — COPY opens one like any statement, and
+            # leaving it dangling holds back vacuum on a long-lived connection
+            self.conn.commit()
+            buf.seek(0)
+            return pd.read_csv(buf, parse_dates=['date'])
+        except Exception as e:
+            # Roll back so a transient failure does not wedge the shared
+            # connection in an aborted transaction for every later read
+            self.conn.rollback()
+            logger.error("Error loading data from the macrotrends_pe_pb_hist table: %s", e)
+            return pd.DataFrame()
+
     ### --- CURRENT RATIOS TABLE OPERATIONS --- ###
     
     def create_current_ratio_table(self) -> None:
@@ -131,24 +252,22 @@ class PostgreSQL:
         except Exception as e:
             raise Exception(f"Error creating current_ratios table: {e}")
 
+    def store_current_ratio_tuples(self, rows: list[tuple]) -> None:
+        """Store (symbol, last_update, pb_ratio, pe_ratio) tuples in the PostgreSQL table."""
+        with self.transaction():
+            # Bind/Execute against the prepared plan, batched into pages so a
+            # page of rows costs one round-trip and zero re-planning
+            self._ensure_prepared()
+            execute_batch(self.cursor, "EXECUTE ins_cur (%s, %s, %s, %s)", rows, page_size=1000)
+            logger.info("Sent %d rows to 'current_ratios' table.", len(rows))
+
     def store_current_ratio_dataframes(self, dataframes: list[pd.DataFrame]) -> None:
         """Store multiple DataFrames in the PostgreSQL table."""
-        insert_query = '''
-        INSERT INTO current_ratios (Symbol, Last_Update, PB_Ratio, PE_Ratio) 
-        VALUES (%s, %s, %s, %s)
-        ON CONFLICT (Symbol) 
-        DO UPDATE SET
-            PB_Ratio = EXCLUDED.PB_Ratio,
-            PE_Ratio = EXCLUDED.PE_Ratio,
-            Last_Update = EXCLUDED.Last_Update;
-        '''
         all_data = []
         for df in dataframes:
             all_data.extend(self.prepare_tuples(df))
-        
-        with self.transaction():
-            self.cursor.executemany(insert_query, all_data)
-            logger.info(f"Sent {len(all_data)} rows to 'current_ratios' table.")
+
+        self.store_current_ratio_tuples(all_data)
 
     def load_current_ratio_dataframe(self, symbol: str = None) -> pd.DataFrame:
         """Load data from the PostgreSQL table."""
@@ -161,14 +280,18 @@ class PostgreSQL:
             df = pd.read_sql(query, self.conn, params=(symbol,))
             return df
         except Exception as e:
-            logger.error(f"Error loading data from current_ratios table: {e}")
+            logger.error("Error loading data from current_ratios table: %s", e)
             return pd.DataFrame()
         
+    def ensure_schema(self) -> None:
+        """Create the tables if they do not already exist; run once at startup."""
+        self.create_report_table()
+        self.create_current_ratio_table()
+
     def __enter__(self):
         # Context handler enter
         self.connect()
-        self.create_report_table() # Create the tables if they do not already exist
-        self.create_current_ratio_table()
+        self.ensure_schema()
         return self
     
     def __exit__(self, exc_type, exc_value, traceback):
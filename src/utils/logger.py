@@ -1,23 +1,33 @@
 import logging
+import os
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 
 from utils.misc import get_logfile
 
 formatter = logging.Formatter('%(module)s : %(levelname)s : %(asctime)s : %(message)s')
 
-# Get logger
+# Get logger; INFO in production so debug records are rejected before they are
+# built at all — the isEnabledFor gates and lazy % args hinge on this level
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+logger.setLevel(logging.DEBUG if os.getenv('LOG_DEBUG') else logging.INFO)
 
 # Get logfile name & setup file handler
 file_handler = logging.FileHandler(get_logfile())
 file_handler.setFormatter(formatter)
 file_handler.setLevel(logging.INFO)
 
-# Setup stream handler
+# Setup stream handler; the chatty per-ticker debug output only exists when
+# LOG_DEBUG is set (see the logger level above), and it goes to the stream only
 stream_handler = logging.StreamHandler()
 stream_handler.setFormatter(formatter)
-stream_handler.setLevel(logging.DEBUG)
+stream_handler.setLevel(logging.DEBUG if os.getenv('LOG_DEBUG') else logging.INFO)
 
-# Add handlers
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
\ No newline at end of file
+# Route records through a queue: the caller merges the message and enqueues
+# (QueueHandler.prepare formats in the emitting thread), while the file and
+# stream writes happen on the listener thread off the hot path
+_log_queue = SimpleQueue()
+_listener = QueueListener(_log_queue, file_handler, stream_handler, respect_handler_level=True)
+_listener.start()
+
+logger.addHandler(QueueHandler(_log_queue))
\ No newline at end of file